@@ -1,5 +1,9 @@
 #!/usr/bin/env python3
+import logging
 import math
+import os
+import select
+import struct
 import time
 
 import libevdev
@@ -31,6 +35,7 @@ ACCELERATION_MAX_MULTIPLIER = 3.0  # Maximum acceleration multiplier
 ACCELERATION_MIN_TIME_DELTA = (
     0.001  # Minimum time delta for speed calculation (seconds)
 )
+DEBUG = False  # Log gesture diagnostics ([DOWN], [CLICK], [DRAG], ...) to stderr
 
 # ===== Configuration Examples =====
 # Adjust these values for your specific device:
@@ -114,6 +119,12 @@ ACCELERATION_MIN_TIME_DELTA = (
 #       LONG_PRESS_MOVE_THRESHOLD = 5   # Stricter (less movement allowed)
 #       LONG_PRESS_MOVE_THRESHOLD = 20  # Lenient (more movement allowed)
 #
+# 10. Diagnostics:
+#    a. Show every touch, click and drag as it is recognized:
+#       DEBUG = True
+#    b. Quiet (no per-gesture output, lowest latency):
+#       DEBUG = False
+#
 # Troubleshooting Guide:
 # 1. If cursor moves opposite direction: Try different MOVE_X/Y_MULTIPLIER combinations
 # 2. If cursor moves too fast/slow: Adjust MOVE_SCALE and multipliers
@@ -128,11 +139,165 @@ C_YLW = "\033[33m"
 C_BLU = "\033[34m"
 C_RST = "\033[0m"
 
+# Color of each "[TAG]" message prefix, applied when a record is emitted
+TAG_COLORS = {
+    "DOWN": C_GRN,
+    "SECOND DOWN": C_YLW,
+    "UP": C_RED,
+    "CLICK": C_BLU,
+    "CLICK COUNT": C_YLW,
+    "DRAG": C_RED,
+    "DOUBLE CLICK DRAG": C_BLU,
+    "LONG PRESS DRAG": C_BLU,
+    "LONG PRESS CANCEL": C_YLW,
+    "RIGHT HOLD": C_BLU,
+    "DROPPED": C_RED,
+}
+
+
+class TagColorFormatter(logging.Formatter):
+    def format(self, record):
+        msg = super().format(record)
+        end = msg.find("]")
+        color = TAG_COLORS.get(msg[1:end]) if msg.startswith("[") else None
+        if color is None:
+            return msg
+        return f"{color}{msg[: end + 1]}{C_RST}{msg[end + 1 :]}"
+
+
+log = logging.getLogger("touchpad")
+
+
+# ===== Event keys =====
+# Events are dispatched on (type << 16) | code, compared as a single plain int
+def _event_key(code):
+    return (code.type.value << 16) | code.value
+
+
+# ===== Raw event reads =====
+# struct input_event: struct timeval time; __u16 type; __u16 code; __s32 value
+_INPUT_EVENT = struct.Struct("llHHi")
+
+# ===== Raw event writes =====
+# Output goes to the uinput fd as packed input_event records, one write() per
+# report; uinput ignores the timestamps, which are left zeroed. Cursor motion
+# is packed per report as REL_X, REL_Y, SYN_REPORT with the timeval as padding
+_TIMEVAL_PAD = f"{struct.calcsize('ll')}x"
+_MOTION_REPORT = struct.Struct(f"{_TIMEVAL_PAD}HHi" * 3)
+
+# ===== Motion constants =====
+_X_GAIN = MOVE_SCALE * MOVE_X_MULTIPLIER  # Touch delta -> cursor delta, X axis
+_Y_GAIN = MOVE_SCALE * MOVE_Y_MULTIPLIER  # Touch delta -> cursor delta, Y axis
+_SPEED_ALPHA = 0.3  # Smoothing factor of the acceleration speed average
+_ONE_MINUS_SPEED_ALPHA = 1.0 - _SPEED_ALPHA
+
+
+# ===== Prebuilt output events (packed once, written as-is to uinput) =====
+def _pack_events(*events):
+    return b"".join(
+        _INPUT_EVENT.pack(0, 0, code.type.value, code.value, value)
+        for code, value in events
+    )
+
+
+_SYN = (libevdev.EV_SYN.SYN_REPORT, 0)
+LEFT_PRESS = _pack_events((libevdev.EV_KEY.BTN_LEFT, 1), _SYN)
+LEFT_RELEASE = _pack_events((libevdev.EV_KEY.BTN_LEFT, 0), _SYN)
+LEFT_CLICK = LEFT_PRESS + LEFT_RELEASE
+RIGHT_PRESS = _pack_events((libevdev.EV_KEY.BTN_RIGHT, 1), _SYN)
+RIGHT_RELEASE = _pack_events((libevdev.EV_KEY.BTN_RIGHT, 0), _SYN)
+RIGHT_CLICK = RIGHT_PRESS + RIGHT_RELEASE
+WHEEL_UP = _pack_events((libevdev.EV_REL.REL_WHEEL, 1), _SYN)
+WHEEL_DOWN = _pack_events((libevdev.EV_REL.REL_WHEEL, -1), _SYN)
+
+
+# ===== Motion processing, specialised once for the configuration =====
+# make_processor() returns (scroll, move) with SWAP_AXES, INVERT_SCROLL and
+# ACCELERATION_ENABLED already decided, so a frame never tests them:
+#   scroll(avg_dx, avg_dy) -> packed wheel report to send, or None below threshold
+#   move(avg_dx, avg_dy, dt_ns) -> (move_x, move_y) cursor delta
+def make_processor(swap, invert, accel):
+    # Finger moving towards smaller coordinates scrolls up, unless inverted
+    on_neg, on_pos = (WHEEL_DOWN, WHEEL_UP) if invert else (WHEEL_UP, WHEEL_DOWN)
+    # Constants the closures use, read from cells instead of module globals.
+    # The scroll threshold is compared on both sides instead of via abs().
+    scroll_threshold = SCROLL_THRESHOLD
+    neg_scroll_threshold = -SCROLL_THRESHOLD
+    kx = _X_GAIN
+    ky = _Y_GAIN
+    # In nanoseconds, like the dt_ns passed to move()
+    min_dt_ns = int(ACCELERATION_MIN_TIME_DELTA * 1e9)
+
+    if swap:
+        # When axes are swapped, horizontal finger movement (dx) scrolls
+        def scroll(dx, dy):
+            if dx > scroll_threshold or dx < neg_scroll_threshold:
+                return on_neg if dx < 0 else on_pos
+            return None
+
+    else:
+        # Normal case: vertical finger movement (dy) scrolls
+        def scroll(dx, dy):
+            if dy > scroll_threshold or dy < neg_scroll_threshold:
+                return on_neg if dy < 0 else on_pos
+            return None
+
+    if not accel:
+        if swap:
+            # X movement becomes Y, Y movement becomes X
+            def move(dx, dy, dt_ns):
+                return int(dy * kx), int(dx * ky)
+
+        else:
+
+            def move(dx, dy, dt_ns):
+                return int(dx * kx), int(dy * ky)
+
+        return scroll, move
+
+    last_speed = 0.0
+
+    def multiplier(dx, dy, dt_ns):
+        nonlocal last_speed
+        if dt_ns <= min_dt_ns:
+            return 1.0
+        # Calculate speed based on movement distance
+        current_speed = math.sqrt(dx * dx + dy * dy) / (dt_ns / 1e9)
+        # Smooth speed transition using exponential moving average
+        last_speed = last_speed * _ONE_MINUS_SPEED_ALPHA + current_speed * _SPEED_ALPHA
+        # Faster movement = larger multiplier, capped at the configured maximum
+        m = 1.0 + last_speed * ACCELERATION_FACTOR
+        if m > ACCELERATION_MAX_MULTIPLIER:
+            return ACCELERATION_MAX_MULTIPLIER
+        return m
+
+    if swap:
+
+        def move(dx, dy, dt_ns):
+            m = multiplier(dx, dy, dt_ns)
+            return int(dy * kx * m), int(dx * ky * m)
+
+    else:
+
+        def move(dx, dy, dt_ns):
+            m = multiplier(dx, dy, dt_ns)
+            return int(dx * kx * m), int(dy * ky * m)
+
+    return scroll, move
+
+
 # ===== Touchscreen device =====
 device_path = "/dev/input/event26"  # It's for Moonlight game stream, idk if this script works in other devices
+uinput_path = "/dev/uinput"  # Node the virtual touchpad is created through
 
 
 def main():
+    if DEBUG:
+        handler = logging.StreamHandler()
+        handler.setFormatter(TagColorFormatter())
+        log.addHandler(handler)
+        log.setLevel(logging.DEBUG)
+
     try:
         fd = open(device_path, "rb")
     except PermissionError:
@@ -143,6 +308,10 @@ def main():
         return
     dev = libevdev.Device(fd)
     dev.grab()
+    # libevdev handles setup (grab, device info such as absinfo); events are
+    # read as raw struct input_event records straight from the fd
+    fd_no = fd.fileno()
+    os.set_blocking(fd_no, False)
 
     vdev = libevdev.Device()
     vdev.name = "Adaptive Virtual Touchpad"
@@ -155,430 +324,495 @@ def main():
     for code in [libevdev.EV_KEY.BTN_LEFT, libevdev.EV_KEY.BTN_RIGHT]:
         vdev.enable(code)
 
-    uinput = vdev.create_uinput_device()
-    print(f"{C_GRN}--- Adaptive Touchpad ---{C_RST}")
-
-    slots = {}
-    last_pos = {}
-    slot2id = {}
-
-    cur_slot = 0
-    main_finger_id = None
-    touch_start_time = 0.0
-    moved_far = False
-    in_touch_cycle = False
-    dragging = False
-    last_click_time = 0.0
-    click_count = 0
-    last_process_time = time.time()
-    last_speed = 0.0
-    long_press_start_pos = None
-    long_press_triggered = False
-    long_press_cancelled = False
-    right_button_held = False
-    second_finger_id = None
-    right_hold_pending = False
-
-    try:
-        for ev in dev.events():
-            if ev.matches(libevdev.EV_ABS.ABS_MT_SLOT):
-                cur_slot = ev.value
-
-            elif ev.matches(libevdev.EV_ABS.ABS_MT_TRACKING_ID):
-                if ev.value != -1:
-                    tid = ev.value
-                    old_id = slot2id.get(cur_slot)
-                    if old_id is not None and old_id != tid:
-                        slots.pop(old_id, None)
-                        last_pos.pop(old_id, None)
-                    slot2id[cur_slot] = tid
-                    slots[tid] = {
-                        "slot": cur_slot,
-                        "x": None,
-                        "y": None,
-                        "press_time": time.time(),
-                    }
-
-                    if not in_touch_cycle:
-                        main_finger_id = tid
-                        touch_start_time = time.time()
-                        moved_far = False
-                        in_touch_cycle = True
-                        long_press_triggered = False
-                        long_press_cancelled = False
-                        if LONG_PRESS_DRAG:
-                            pass
-                        else:
-                            current_time = time.time()
-                            if (
-                                current_time - last_click_time < DOUBLE_CLICK_TIMEOUT
-                                and click_count == 1
-                            ):
-                                dragging = True
-                                uinput.send_events(
-                                    [
-                                        libevdev.InputEvent(
-                                            libevdev.EV_KEY.BTN_LEFT, 1
-                                        ),
-                                        libevdev.InputEvent(
-                                            libevdev.EV_SYN.SYN_REPORT, 0
-                                        ),
-                                    ]
-                                )
-                                print(
-                                    f"{C_BLU}[DOUBLE CLICK DRAG]{C_RST} Double-click detected, dragging started"
-                                )
-                            else:
-                                pass
-                        print(
-                            f"{C_GRN}[DOWN]{C_RST} Slot {cur_slot} Tracking {tid} Pressing(Main finger)"
-                        )
+    # Open the uinput node ourselves so events can be written to it directly;
+    # libevdev only creates the device, which lives as long as `uinput` does.
+    # The node is closed once the virtual touchpad has been removed.
+    with open(uinput_path, "r+b", buffering=0) as uinput_file:
+        uinput = vdev.create_uinput_device(uinput_file)
+        uinput_fd = uinput_file.fileno()
+        scroll, move = make_processor(SWAP_AXES, INVERT_SCROLL, ACCELERATION_ENABLED)
+        print(f"{C_GRN}--- Adaptive Touchpad ---{C_RST}")
+
+        # Per-slot touch state as parallel lists indexed by MT slot (-1 = unset)
+        slot_info = dev.absinfo[libevdev.EV_ABS.ABS_MT_SLOT]
+        # Without ABS_MT_SLOT every contact is reported in the implicit slot 0
+        n_slots = slot_info.maximum + 1 if slot_info is not None else 1
+        slot_tid = [-1] * n_slots
+        slot_x = [-1] * n_slots
+        slot_y = [-1] * n_slots
+        slot_last_x = [-1] * n_slots
+        slot_last_y = [-1] * n_slots
+        slot_press_ns = [0] * n_slots
+
+        # Slots whose x and y are both known, kept up to date as positions arrive
+        # so a frame only visits the slots that are actually touching
+        have_xy = 0
+        dirty = False  # A position arrived since the last SYN_REPORT
+
+        cur_slot = 0
+        cur_bit = 1  # 1 << cur_slot
+        cur_tracked = False  # Whether cur_slot holds a contact we saw go down
+        main_slot = -1
+        touch_start_ns = 0
+        moved_far = False
+        in_touch_cycle = False
+        dragging = False
+        last_click_ns = 0
+        click_count = 0
+        last_process_ns = time.monotonic_ns()
+        long_press_start_pos = None
+        long_press_triggered = False
+        long_press_cancelled = False
+        right_button_held = False
+        second_slot = -1
+        right_hold_pending = False
+        dropping = False  # Kernel dropped events; skip until the next SYN_REPORT
+
+        # Constants, settings and callables used per event and per frame are
+        # locals, so the loop runs on LOAD_FAST instead of global and attribute
+        # lookups. Only builtins on rare paths (SYN_DROPPED recovery, hand-over of
+        # the main finger) and exception classes are still looked up.
+        _MT_X = _event_key(libevdev.EV_ABS.ABS_MT_POSITION_X)
+        _MT_Y = _event_key(libevdev.EV_ABS.ABS_MT_POSITION_Y)
+        _MT_SLOT = _event_key(libevdev.EV_ABS.ABS_MT_SLOT)
+        _MT_TID = _event_key(libevdev.EV_ABS.ABS_MT_TRACKING_ID)
+        _SYN_REPORT = _event_key(libevdev.EV_SYN.SYN_REPORT)
+        _SYN_DROPPED = _event_key(libevdev.EV_SYN.SYN_DROPPED)
+        _READ_SIZE = _INPUT_EVENT.size * 256  # Up to 256 events per read() call
+        # Timings in nanoseconds, compared against time.monotonic_ns()
+        _CLICK_TIME_NS = int(CLICK_TIME * 1e9)
+        _RIGHT_CLICK_TAP_NS = int(RIGHT_CLICK_TAP * 1e9)
+        _DOUBLE_CLICK_TIMEOUT_NS = int(DOUBLE_CLICK_TIMEOUT * 1e9)
+        _LONG_PRESS_TIME_NS = int(LONG_PRESS_TIME * 1e9)
+        _MOTION_FLUSH_NS = 4_000_000  # Coalesce cursor motion for at most 4 ms
+        _LONG_PRESS_MOVE_THRESHOLD_SQ = LONG_PRESS_MOVE_THRESHOLD**2
+        _MOVE_THRESHOLD = MOVE_THRESHOLD
+        _NEG_MOVE_THRESHOLD = -MOVE_THRESHOLD  # Lets the loop skip abs()
+        _LONG_PRESS_DRAG = LONG_PRESS_DRAG
+        _DEBUG = DEBUG
+        _debug = log.debug
+        _LEFT_PRESS = LEFT_PRESS
+        _LEFT_RELEASE = LEFT_RELEASE
+        _LEFT_CLICK = LEFT_CLICK
+        _RIGHT_PRESS = RIGHT_PRESS
+        _RIGHT_RELEASE = RIGHT_RELEASE
+        _RIGHT_CLICK = RIGHT_CLICK
+        _write = os.write
+        _pack_motion = _MOTION_REPORT.pack
+        _TYPE_REL = libevdev.EV_REL.REL_X.type.value
+        _CODE_REL_X = libevdev.EV_REL.REL_X.value
+        _CODE_REL_Y = libevdev.EV_REL.REL_Y.value
+        _TYPE_SYN = libevdev.EV_SYN.SYN_REPORT.type.value
+        _CODE_SYN_REPORT = libevdev.EV_SYN.SYN_REPORT.value
+        _now = time.monotonic_ns
+        _read = os.read
+        _iter_unpack = _INPUT_EVENT.iter_unpack
+
+        # Cursor motion is accumulated and written at most every
+        # _MOTION_FLUSH_NS; anything else that goes out flushes it first
+        pending_dx = pending_dy = 0
+        last_flush_ns = 0
+
+        def flush_motion():
+            nonlocal pending_dx, pending_dy
+            if pending_dx or pending_dy:
+                _write(
+                    uinput_fd,
+                    _pack_motion(
+                        _TYPE_REL,
+                        _CODE_REL_X,
+                        pending_dx,
+                        _TYPE_REL,
+                        _CODE_REL_Y,
+                        pending_dy,
+                        _TYPE_SYN,
+                        _CODE_SYN_REPORT,
+                        0,
+                    ),
+                )
+                pending_dx = pending_dy = 0
+
+        def emit(events):
+            flush_motion()
+            _write(uinput_fd, events)
+
+        ep = select.epoll()
+        # Edge-triggered: one wakeup per burst, which is safe because the loop
+        # below always reads until EAGAIN before waiting again
+        ep.register(fd_no, select.EPOLLIN | select.EPOLLET)
+        _poll = ep.poll
+
+        try:
+            while True:
+                # Keep reading batches until the kernel queue is drained, and only
+                # then sleep in epoll until the device has data again
+                try:
+                    data = _read(fd_no, _READ_SIZE)
+                except BlockingIOError:
+                    if pending_dx or pending_dy:
+                        # Held-back motion goes out at its deadline if no new
+                        # input arrives before then
+                        wait = (last_flush_ns + _MOTION_FLUSH_NS - _now()) / 1e9
+                        if wait <= 0 or not _poll(wait):
+                            flush_motion()
+                            last_flush_ns = _now()
                     else:
-                        print(
-                            f"{C_YLW}[SECOND DOWN]{C_RST} Slot {cur_slot} Tracking {tid} Pressing(Second finger)"
-                        )
-                        # Cancel left button drag if second finger touches
-                        if dragging:
-                            uinput.send_events(
-                                [
-                                    libevdev.InputEvent(libevdev.EV_KEY.BTN_LEFT, 0),
-                                    libevdev.InputEvent(libevdev.EV_SYN.SYN_REPORT, 0),
-                                ]
-                            )
-                            dragging = False
-                            print(
-                                f"{C_RED}[DRAG]{C_RST} Cancel dragging due to second finger"
-                            )
-                        # Cancel long-press monitoring for this touch cycle
-                        long_press_cancelled = True
-                        # Start monitoring for right hold (activate after RIGHT_CLICK_TAP if no scroll)
-                        second_finger_id = tid
-                        right_hold_pending = True
-
-                else:
-                    tid = slot2id.get(cur_slot)
-                    if tid is not None:
-                        press_time = slots.get(tid, {}).get("press_time", time.time())
-                        duration = time.time() - press_time
-                        print(
-                            f"{C_RED}[UP]{C_RST} Slot {cur_slot} Tracking {tid} Release(Duration: {duration:.2f}s)"
-                        )
-
-                        if tid == second_finger_id:
-                            if right_hold_pending and duration < RIGHT_CLICK_TAP:
-                                uinput.send_events(
-                                    [
-                                        libevdev.InputEvent(
-                                            libevdev.EV_KEY.BTN_RIGHT, 1
-                                        ),
-                                        libevdev.InputEvent(
-                                            libevdev.EV_SYN.SYN_REPORT, 0
-                                        ),
-                                        libevdev.InputEvent(
-                                            libevdev.EV_KEY.BTN_RIGHT, 0
-                                        ),
-                                        libevdev.InputEvent(
-                                            libevdev.EV_SYN.SYN_REPORT, 0
-                                        ),
-                                    ]
-                                )
-                                print(f"{C_BLU}[CLICK]{C_RST} Right Click")
+                        _poll()
+                    continue
+                if not data:
+                    break  # Device is gone
+                for _sec, _usec, ev_type, code, value in _iter_unpack(data):
+                    # Ordered by frequency: positions dominate a touch stream
+                    key = (ev_type << 16) | code
+                    if key == _MT_X:
+                        if cur_tracked:
+                            slot_x[cur_slot] = value
+                            dirty = True
+                            if slot_y[cur_slot] != -1:
+                                have_xy |= cur_bit
+                    elif key == _MT_Y:
+                        if cur_tracked:
+                            slot_y[cur_slot] = value
+                            dirty = True
+                            if slot_x[cur_slot] != -1:
+                                have_xy |= cur_bit
+
+                    elif key == _SYN_REPORT:
+                        if dropping:
+                            # The frames around the overflow are incomplete, so the
+                            # per-slot state can no longer be trusted: forget every
+                            # contact and release held buttons. Fingers still down
+                            # are ignored until they lift and touch again.
+                            dropping = False
+                            for s in range(n_slots):
+                                slot_tid[s] = slot_x[s] = slot_y[s] = -1
+                                slot_last_x[s] = slot_last_y[s] = -1
+                            have_xy = 0
+                            dirty = False
+                            cur_tracked = False
+                            if dragging:
+                                emit(_LEFT_RELEASE)
+                                dragging = False
                             if right_button_held:
+                                emit(_RIGHT_RELEASE)
                                 right_button_held = False
-                                uinput.send_events(
-                                    [
-                                        libevdev.InputEvent(
-                                            libevdev.EV_KEY.BTN_RIGHT, 0
-                                        ),
-                                        libevdev.InputEvent(
-                                            libevdev.EV_SYN.SYN_REPORT, 0
-                                        ),
-                                    ]
-                                )
-                                print(f"{C_RED}[DRAG]{C_RST} Stop right dragging")
-                            second_finger_id = None
+                            in_touch_cycle = False
+                            main_slot = second_slot = -1
                             right_hold_pending = False
+                            long_press_start_pos = None
+                            long_press_triggered = False
+                            long_press_cancelled = False
+                            continue
+                        if not have_xy:
+                            continue  # No finger with a known position
+
+                        dx = dy = count = 0
+                        main_moved = False
+                        if dirty:
+                            dirty = False
+                            # have_xy & (have_xy - 1) clears the lowest set bit, so
+                            # it is zero exactly when a single finger is down
+                            if not have_xy & (have_xy - 1):
+                                # Single finger, the common case: take its delta
+                                # directly instead of walking the bitmask
+                                s = have_xy.bit_length() - 1
+                                x = slot_x[s]
+                                y = slot_y[s]
+                                if slot_last_x[s] != -1:
+                                    dx = x - slot_last_x[s]
+                                    dy = y - slot_last_y[s]
+                                    count = 1
+                                    if s == main_slot:
+                                        main_moved = True
+                                        main_dx = dx
+                                        main_dy = dy
+                                slot_last_x[s] = x
+                                slot_last_y[s] = y
+                            else:
+                                m = have_xy
+                                while m:
+                                    low = m & -m
+                                    m ^= low
+                                    s = low.bit_length() - 1
+                                    x = slot_x[s]
+                                    y = slot_y[s]
+                                    if slot_last_x[s] != -1:
+                                        ddx = x - slot_last_x[s]
+                                        ddy = y - slot_last_y[s]
+                                        if s == main_slot:
+                                            main_moved = True
+                                            main_dx = ddx
+                                            main_dy = ddy
+                                        dx += ddx
+                                        dy += ddy
+                                        count += 1
+                                    slot_last_x[s] = x
+                                    slot_last_y[s] = y
+                        else:
+                            # No position changed since the last frame: every
+                            # positioned slot has a zero delta, but the long-press
+                            # and right-hold timers below still have to run
+                            count = bin(have_xy).count("1")
+
+                        if count:
+                            # One clock read per frame, only with a positioned finger
+                            now = _now()
+                            dt_ns = now - last_process_ns
+                            avg_dx = dx / count
+                            avg_dy = dy / count
+
+                            if right_button_held and main_moved:
+                                avg_dx = main_dx
+                                avg_dy = main_dy
+
+                            main_has_pos = main_slot != -1 and have_xy >> main_slot & 1
+                            if (
+                                _LONG_PRESS_DRAG
+                                and main_has_pos
+                                and long_press_start_pos is None
+                            ):
+                                long_press_start_pos = (
+                                    slot_x[main_slot],
+                                    slot_y[main_slot],
+                                )
+
+                            if (
+                                _LONG_PRESS_DRAG
+                                and not dragging
+                                and not long_press_triggered
+                                and not long_press_cancelled
+                                and main_has_pos
+                            ):
+                                hold_ns = now - touch_start_ns
+                                if hold_ns < _LONG_PRESS_TIME_NS:
+                                    if long_press_start_pos:
+                                        hold_dx = (
+                                            slot_x[main_slot] - long_press_start_pos[0]
+                                        )
+                                        hold_dy = (
+                                            slot_y[main_slot] - long_press_start_pos[1]
+                                        )
+                                        # Compare squared distances, no sqrt needed
+                                        if (
+                                            hold_dx * hold_dx + hold_dy * hold_dy
+                                            >= _LONG_PRESS_MOVE_THRESHOLD_SQ
+                                        ):
+                                            long_press_cancelled = True
+                                            if _DEBUG:
+                                                _debug(
+                                                    "[LONG PRESS CANCEL] Moved too much during hold, long press cancelled"
+                                                )
+                                elif hold_ns >= _LONG_PRESS_TIME_NS:
+                                    dragging = True
+                                    long_press_triggered = True
+                                    emit(_LEFT_PRESS)
+                                    if _DEBUG:
+                                        _debug(
+                                            "[LONG PRESS DRAG] Long-press detected, dragging started"
+                                        )
+
+                            if (
+                                right_hold_pending
+                                and have_xy >> second_slot & 1
+                                and now - slot_press_ns[second_slot]
+                                >= _RIGHT_CLICK_TAP_NS
+                            ):
+                                right_button_held = True
+                                right_hold_pending = False
+                                emit(_RIGHT_PRESS)
+                                if _DEBUG:
+                                    _debug("[RIGHT HOLD] Right button held")
 
-                        slots.pop(tid, None)
-                        last_pos.pop(tid, None)
-                        slot2id.pop(cur_slot, None)
+                            if (
+                                avg_dx > _MOVE_THRESHOLD
+                                or avg_dx < _NEG_MOVE_THRESHOLD
+                                or avg_dy > _MOVE_THRESHOLD
+                                or avg_dy < _NEG_MOVE_THRESHOLD
+                            ):
+                                moved_far = True
 
-                        if tid == main_finger_id and in_touch_cycle:
-                            total_time = time.time() - touch_start_time
-                            if right_button_held:
-                                remaining = [t for t in slots]
-                                if remaining:
-                                    main_finger_id = remaining[0]
+                                if have_xy & (have_xy - 1) and not right_button_held:
+                                    wheel = scroll(avg_dx, avg_dy)
+                                    if wheel is not None:
+                                        emit(wheel)
+                                        right_hold_pending = False
+                                else:
+                                    # Single finger movement
+                                    move_x, move_y = move(avg_dx, avg_dy, dt_ns)
+                                    pending_dx += move_x
+                                    pending_dy += move_y
+                                    if now - last_flush_ns >= _MOTION_FLUSH_NS:
+                                        flush_motion()
+                                        last_flush_ns = now
+
+                            # Update last_process_ns only when we have actual movement data
+                            last_process_ns = now
+
+                    elif key == _MT_SLOT:
+                        if dropping:
+                            continue
+                        cur_slot = value
+                        cur_bit = 1 << value
+                        cur_tracked = slot_tid[cur_slot] != -1
+
+                    elif key == _MT_TID:
+                        if dropping:
+                            continue
+                        now = _now()
+                        if value != -1:
+                            tid = value
+                            # A new tracking id replaces whatever the slot held
+                            slot_tid[cur_slot] = tid
+                            slot_x[cur_slot] = slot_y[cur_slot] = -1
+                            slot_last_x[cur_slot] = slot_last_y[cur_slot] = -1
+                            have_xy &= ~cur_bit
+                            slot_press_ns[cur_slot] = now
+                            cur_tracked = True
+
+                            if not in_touch_cycle:
+                                main_slot = cur_slot
+                                touch_start_ns = now
+                                moved_far = False
+                                in_touch_cycle = True
+                                long_press_triggered = False
+                                long_press_cancelled = False
+                                if _LONG_PRESS_DRAG:
+                                    pass
                                 else:
-                                    in_touch_cycle = False
-                                    main_finger_id = None
-                            else:
-                                if (
-                                    not dragging
-                                    and not moved_far
-                                    and total_time < CLICK_TIME
-                                ):
-                                    uinput.send_events(
-                                        [
-                                            libevdev.InputEvent(
-                                                libevdev.EV_KEY.BTN_LEFT, 1
-                                            ),
-                                            libevdev.InputEvent(
-                                                libevdev.EV_SYN.SYN_REPORT, 0
-                                            ),
-                                            libevdev.InputEvent(
-                                                libevdev.EV_KEY.BTN_LEFT, 0
-                                            ),
-                                            libevdev.InputEvent(
-                                                libevdev.EV_SYN.SYN_REPORT, 0
-                                            ),
-                                        ]
-                                    )
-                                    print(f"{C_BLU}[CLICK]{C_RST} Left Click")
-                                    # Record click time for double-click detection
-                                    current_time = time.time()
                                     if (
-                                        current_time - last_click_time
-                                        < DOUBLE_CLICK_TIMEOUT
+                                        now - last_click_ns < _DOUBLE_CLICK_TIMEOUT_NS
+                                        and click_count == 1
                                     ):
-                                        click_count += 1
+                                        dragging = True
+                                        emit(_LEFT_PRESS)
+                                        if _DEBUG:
+                                            _debug(
+                                                "[DOUBLE CLICK DRAG] Double-click detected, dragging started"
+                                            )
                                     else:
-                                        click_count = 1
-                                    last_click_time = current_time
-                                    print(f"{C_YLW}[CLICK COUNT]{C_RST} {click_count}")
-                                # End dragging if dragging
-                                if dragging:
-                                    uinput.send_events(
-                                        [
-                                            libevdev.InputEvent(
-                                                libevdev.EV_KEY.BTN_LEFT, 0
-                                            ),
-                                            libevdev.InputEvent(
-                                                libevdev.EV_SYN.SYN_REPORT, 0
-                                            ),
-                                        ]
-                                    )
-                                    dragging = False
-                                    print(f"{C_RED}[DRAG]{C_RST} Stop dragging")
-                                # Reset double-click drag mode when finger releases
-                                in_touch_cycle = False
-                                main_finger_id = None
-                                long_press_start_pos = None
-                                long_press_triggered = False
-                                long_press_cancelled = False
-
-            elif ev.matches(libevdev.EV_ABS.ABS_MT_POSITION_X):
-                tid = slot2id.get(cur_slot)
-                if tid in slots:
-                    slots[tid]["x"] = ev.value
-            elif ev.matches(libevdev.EV_ABS.ABS_MT_POSITION_Y):
-                tid = slot2id.get(cur_slot)
-                if tid in slots:
-                    slots[tid]["y"] = ev.value
-
-            if ev.matches(libevdev.EV_SYN.SYN_REPORT):
-                active = [
-                    tid
-                    for tid, s in slots.items()
-                    if s["x"] is not None and s["y"] is not None
-                ]
-
-                dx = dy = count = 0
-                finger_deltas = {}
-                for tid in active:
-                    if tid in last_pos:
-                        ddx = slots[tid]["x"] - last_pos[tid][0]
-                        ddy = slots[tid]["y"] - last_pos[tid][1]
-                        finger_deltas[tid] = (ddx, ddy)
-                        dx += ddx
-                        dy += ddy
-                        count += 1
-                    last_pos[tid] = (slots[tid]["x"], slots[tid]["y"])
-
-                # Calculate time delta before processing movement
-                current_time = time.time()
-                time_delta = current_time - last_process_time
-
-                if count:
-                    avg_dx = dx / count
-                    avg_dy = dy / count
-
-                    if right_button_held and main_finger_id in finger_deltas:
-                        avg_dx, avg_dy = finger_deltas[main_finger_id]
-
-                    main_finger_data = slots.get(main_finger_id)
-                    if (
-                        LONG_PRESS_DRAG
-                        and main_finger_data
-                        and main_finger_data["x"] is not None
-                        and main_finger_data["y"] is not None
-                        and long_press_start_pos is None
-                    ):
-                        long_press_start_pos = (
-                            main_finger_data["x"],
-                            main_finger_data["y"],
-                        )
-
-                    if (
-                        LONG_PRESS_DRAG
-                        and not dragging
-                        and not long_press_triggered
-                        and not long_press_cancelled
-                        and main_finger_data
-                        and main_finger_data["x"] is not None
-                        and main_finger_data["y"] is not None
-                    ):
-                        hold_time = current_time - touch_start_time
-                        if hold_time < LONG_PRESS_TIME:
-                            if long_press_start_pos:
-                                current_pos = (
-                                    main_finger_data["x"],
-                                    main_finger_data["y"],
-                                )
-                                total_move = math.sqrt(
-                                    (current_pos[0] - long_press_start_pos[0]) ** 2
-                                    + (current_pos[1] - long_press_start_pos[1]) ** 2
-                                )
-                                if total_move >= LONG_PRESS_MOVE_THRESHOLD:
-                                    long_press_cancelled = True
-                                    print(
-                                        f"{C_YLW}[LONG PRESS CANCEL]{C_RST} Moved too much during hold, long press cancelled"
+                                        pass
+                                if _DEBUG:
+                                    _debug(
+                                        "[DOWN] Slot %d Tracking %d Pressing(Main finger)",
+                                        cur_slot,
+                                        tid,
                                     )
-                        elif hold_time >= LONG_PRESS_TIME:
-                            dragging = True
-                            long_press_triggered = True
-                            uinput.send_events(
-                                [
-                                    libevdev.InputEvent(libevdev.EV_KEY.BTN_LEFT, 1),
-                                    libevdev.InputEvent(libevdev.EV_SYN.SYN_REPORT, 0),
-                                ]
-                            )
-                            print(
-                                f"{C_BLU}[LONG PRESS DRAG]{C_RST} Long-press detected, dragging started"
-                            )
-
-                    if right_hold_pending and second_finger_id in active:
-                        second_data = slots.get(second_finger_id)
-                        if second_data and second_data.get("press_time"):
-                            second_hold_time = current_time - second_data["press_time"]
-                            if second_hold_time >= RIGHT_CLICK_TAP:
-                                right_button_held = True
-                                right_hold_pending = False
-                                uinput.send_events(
-                                    [
-                                        libevdev.InputEvent(
-                                            libevdev.EV_KEY.BTN_RIGHT, 1
-                                        ),
-                                        libevdev.InputEvent(
-                                            libevdev.EV_SYN.SYN_REPORT, 0
-                                        ),
-                                    ]
-                                )
-                                print(f"{C_BLU}[RIGHT HOLD]{C_RST} Right button held")
-
-                    if abs(avg_dx) > MOVE_THRESHOLD or abs(avg_dy) > MOVE_THRESHOLD:
-                        moved_far = True
-                        out = []
-
-                        if len(active) >= 2 and not right_button_held:
-                            # For scrolling, we need to consider axis swapping
-                            if SWAP_AXES:
-                                # When axes are swapped, horizontal finger movement (dx) becomes vertical scroll
-                                scroll_value = avg_dx
                             else:
-                                # Normal case: vertical finger movement (dy) controls scrolling
-                                scroll_value = avg_dy
-
-                            if abs(scroll_value) > SCROLL_THRESHOLD:
-                                wheel_val = 1 if scroll_value < 0 else -1
-                                if INVERT_SCROLL:
-                                    wheel_val *= -1
-                                out.append(
-                                    libevdev.InputEvent(
-                                        libevdev.EV_REL.REL_WHEEL, wheel_val
+                                if _DEBUG:
+                                    _debug(
+                                        "[SECOND DOWN] Slot %d Tracking %d Pressing(Second finger)",
+                                        cur_slot,
+                                        tid,
                                     )
-                                )
-                                right_hold_pending = False
-                        else:
-                            # Single finger movement
-                            if SWAP_AXES:
-                                # Swap X and Y axes: X movement becomes Y, Y movement becomes X
-                                raw_move_x = avg_dy
-                                raw_move_y = avg_dx
-                            else:
-                                raw_move_x = avg_dx
-                                raw_move_y = avg_dy
-
-                            # Apply cursor acceleration if enabled
-                            if (
-                                ACCELERATION_ENABLED
-                                and time_delta > ACCELERATION_MIN_TIME_DELTA
-                            ):
-                                # Calculate speed based on movement distance
-                                movement_distance = math.sqrt(
-                                    raw_move_x**2 + raw_move_y**2
-                                )
-                                current_speed = movement_distance / time_delta
+                                # Cancel left button drag if second finger touches
+                                if dragging:
+                                    emit(_LEFT_RELEASE)
+                                    dragging = False
+                                    if _DEBUG:
+                                        _debug(
+                                            "[DRAG] Cancel dragging due to second finger"
+                                        )
+                                # Cancel long-press monitoring for this touch cycle
+                                long_press_cancelled = True
+                                # Start monitoring for right hold (activate after RIGHT_CLICK_TAP if no scroll)
+                                second_slot = cur_slot
+                                right_hold_pending = True
 
-                                # Smooth speed transition using exponential moving average
-                                speed_alpha = 0.3  # Smoothing factor
-                                smoothed_speed = (
-                                    last_speed * (1 - speed_alpha)
-                                    + current_speed * speed_alpha
-                                )
-                                last_speed = smoothed_speed
+                        else:
+                            tid = slot_tid[cur_slot]
+                            if tid != -1:
+                                duration_ns = now - slot_press_ns[cur_slot]
+                                if _DEBUG:
+                                    _debug(
+                                        "[UP] Slot %d Tracking %d Release(Duration: %.2fs)",
+                                        cur_slot,
+                                        tid,
+                                        duration_ns / 1e9,
+                                    )
 
-                                # Apply acceleration curve: faster movement = larger multiplier
-                                # Base multiplier is 1.0, increased by speed * ACCELERATION_FACTOR
-                                acceleration_multiplier = (
-                                    1.0 + smoothed_speed * ACCELERATION_FACTOR
-                                )
-                                # Apply maximum acceleration limit
-                                acceleration_multiplier = min(
-                                    acceleration_multiplier, ACCELERATION_MAX_MULTIPLIER
-                                )
-                            else:
-                                acceleration_multiplier = 1.0
-
-                            move_x = int(
-                                raw_move_x
-                                * MOVE_SCALE
-                                * MOVE_X_MULTIPLIER
-                                * acceleration_multiplier
-                            )
-                            move_y = int(
-                                raw_move_y
-                                * MOVE_SCALE
-                                * MOVE_Y_MULTIPLIER
-                                * acceleration_multiplier
-                            )
-
-                            out.extend(
-                                [
-                                    libevdev.InputEvent(
-                                        libevdev.EV_REL.REL_X,
-                                        move_x,
-                                    ),
-                                    libevdev.InputEvent(
-                                        libevdev.EV_REL.REL_Y,
-                                        move_y,
-                                    ),
-                                ]
-                            )
-
-                        if out:
-                            uinput.send_events(
-                                out
-                                + [libevdev.InputEvent(libevdev.EV_SYN.SYN_REPORT, 0)]
-                            )
-
-                    # Update last_process_time only when we have actual movement data
-                    last_process_time = current_time
-
-    except KeyboardInterrupt:
-        pass
-    finally:
-        dev.ungrab()
+                                if cur_slot == second_slot:
+                                    if (
+                                        right_hold_pending
+                                        and duration_ns < _RIGHT_CLICK_TAP_NS
+                                    ):
+                                        emit(_RIGHT_CLICK)
+                                        if _DEBUG:
+                                            _debug("[CLICK] Right Click")
+                                    if right_button_held:
+                                        right_button_held = False
+                                        emit(_RIGHT_RELEASE)
+                                        if _DEBUG:
+                                            _debug("[DRAG] Stop right dragging")
+                                    second_slot = -1
+                                    right_hold_pending = False
+
+                                slot_tid[cur_slot] = -1
+                                slot_x[cur_slot] = slot_y[cur_slot] = -1
+                                slot_last_x[cur_slot] = slot_last_y[cur_slot] = -1
+                                have_xy &= ~cur_bit
+                                cur_tracked = False
+
+                                if cur_slot == main_slot and in_touch_cycle:
+                                    if right_button_held:
+                                        remaining = [
+                                            s
+                                            for s in range(n_slots)
+                                            if slot_tid[s] != -1
+                                        ]
+                                        if remaining:
+                                            # Hand over to the earliest-pressed finger
+                                            main_slot = min(
+                                                remaining, key=slot_press_ns.__getitem__
+                                            )
+                                        else:
+                                            in_touch_cycle = False
+                                            main_slot = -1
+                                    else:
+                                        if (
+                                            not dragging
+                                            and not moved_far
+                                            and now - touch_start_ns < _CLICK_TIME_NS
+                                        ):
+                                            emit(_LEFT_CLICK)
+                                            if _DEBUG:
+                                                _debug("[CLICK] Left Click")
+                                            # Record click time for double-click detection
+                                            if (
+                                                now - last_click_ns
+                                                < _DOUBLE_CLICK_TIMEOUT_NS
+                                            ):
+                                                click_count += 1
+                                            else:
+                                                click_count = 1
+                                            last_click_ns = now
+                                            if _DEBUG:
+                                                _debug("[CLICK COUNT] %d", click_count)
+                                        # End dragging if dragging
+                                        if dragging:
+                                            emit(_LEFT_RELEASE)
+                                            dragging = False
+                                            if _DEBUG:
+                                                _debug("[DRAG] Stop dragging")
+                                        # Reset double-click drag mode when finger releases
+                                        in_touch_cycle = False
+                                        main_slot = -1
+                                        long_press_start_pos = None
+                                        long_press_triggered = False
+                                        long_press_cancelled = False
+
+                    elif key == _SYN_DROPPED:
+                        if _DEBUG:
+                            _debug("[DROPPED] Kernel event buffer overflowed")
+                        dropping = True
+                        cur_tracked = False
+
+        except KeyboardInterrupt:
+            pass
+        finally:
+            flush_motion()
+            ep.close()
+            dev.ungrab()
+            del uinput  # Removes the virtual touchpad
 
 
 if __name__ == "__main__":